@@ -1,9 +1,18 @@
 import functions_framework
 import os
 import json
+import re
+import math
+import time
+import unicodedata
+import asyncio
+import threading
+import hashlib
 import logging
-import base64
-import httpx
+import io
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageOps
 import google.generativeai as genai
 from flask import Request, jsonify
 
@@ -24,17 +33,455 @@ VISION_MODEL = "gemini-2.0-flash-exp"  # Same model supports vision
 text_model = None
 vision_model = None
 
+# Cold-start warmup must not stall module init on a slow connection
+WARMUP_TIMEOUT_SECONDS = 5
+
+# Shared HTTP client for media downloads - keeps TLS sessions alive across
+# invocations on a warm instance. Created on first image request so
+# text-only instances never import httpx.
+_HTTP = None
+_http_lock = threading.Lock()
+
 if API_KEY:
     genai.configure(api_key=API_KEY)
     try:
         text_model = genai.GenerativeModel(TEXT_MODEL)
         vision_model = genai.GenerativeModel(VISION_MODEL)
         logger.info(f"Initialized models: text={TEXT_MODEL}, vision={VISION_MODEL}")
+
+        # Warm up the gRPC channel/TLS session at cold start so the first
+        # user request doesn't pay for it. Best-effort only.
+        try:
+            text_model.generate_content(
+                "ok",
+                generation_config=genai.types.GenerationConfig(max_output_tokens=1),
+                request_options={"timeout": WARMUP_TIMEOUT_SECONDS}
+            )
+            logger.info("Gemini warmup complete")
+        except Exception as e:
+            logger.warning(f"Gemini warmup failed: {e}")
     except Exception as e:
         logger.error(f"Failed to initialize models: {e}")
 else:
     logger.error("GOOGLE_API_KEY environment variable not set")
 
+# Moderation prompts
+# Built once at import; only the user text is spliced in per request
+TEXT_PROMPT_HEADER = """Role: Strict Content Safety Agent for Wandern - a family-friendly walking/exploration app.
+Task: Analyze the following text for App Store compliance.
+
+STRICT CONTENT POLICY - FLAG ANY OF THESE:
+
+1. NUDITY/SEXUAL CONTENT:
+   - Any references to nudity, pornography, or explicit sexual content
+   - Shirtless photos of men are NOT allowed (except in clear beach/pool context)
+   - Bikini tops and swimwear are OK in beach contexts
+   - Any sexualized content involving minors (ZERO TOLERANCE)
+
+2. AGE RESTRICTIONS:
+   - Content referencing children under 13 participating in app activities
+   - Content that could endanger minors
+   - Predatory behavior of any kind
+
+3. VIOLENCE/SAFETY:
+   - Hate Speech / Harassment / Bullying
+   - Violence, gore, or disturbing content
+   - Dangerous / Illegal Acts / Self-harm
+   - Threats or intimidation
+
+4. OTHER:
+   - Severe Profanity (mild PG-13 is okay)
+   - Personal info sharing (phone numbers, addresses)
+   - Spam / Advertising
+   - Illegal drug use or sales
+
+"""
+
+TEXT_PROMPT_TEMPLATE = TEXT_PROMPT_HEADER + """Input Text: \"{text}\"
+
+Output ONLY valid JSON:
+{{\"is_safe\": true/false, \"flag_reason\": \"short explanation if flagged, else null\", \"category\": \"nudity|age|violence|spam|safe\"}}"""
+
+# Batched variant - several numbered texts judged in one call
+TEXT_BATCH_PROMPT_TEMPLATE = TEXT_PROMPT_HEADER + """Input Texts (one per line, numbered, JSON-quoted):
+{items}
+
+Judge EACH text independently against the policy above.
+Output ONLY a valid JSON array with one object per input text:
+[{{\"index\": <number>, \"is_safe\": true/false, \"flag_reason\": \"short explanation if flagged, else null\", \"category\": \"nudity|age|violence|spam|safe\"}}]"""
+
+# Max texts packed into one batched prompt - keeps well inside the context window
+TEXT_BATCH_MAX_ITEMS = 32
+
+IMAGE_PROMPT = """Role: Strict Content Safety Agent for Wandern - a family-friendly walking app.
+Analyze this image for App Store compliance.
+
+STRICT CONTENT POLICY - FLAG IF IMAGE CONTAINS:
+
+1. NUDITY/SEXUAL:
+   - Any nudity (full or partial)
+   - Shirtless men (FLAG unless clearly beach/pool setting)
+   - Sexually suggestive poses or content
+   - Bikini tops and swimwear are OK in beach/pool contexts only
+
+2. AGE CONCERNS:
+   - Children who appear under 13 years old (FLAG - app is 13+)
+   - If a person looks under 18 but over 13, flag for review
+   - Any content sexualizing minors (ZERO TOLERANCE - immediate flag)
+
+3. VIOLENCE/SAFETY:
+   - Violence, gore, blood, or disturbing imagery
+   - Weapons being used threateningly
+   - Hate symbols, Nazi imagery, offensive gestures
+   - Dangerous activities that could cause harm
+
+4. PRIVACY:
+   - Visible personal information (addresses, credit cards, IDs)
+   - License plates, house numbers in identifiable context
+
+Output ONLY valid JSON:
+{\"is_safe\": true/false, \"flag_reason\": \"specific explanation if flagged, else null\", \"category\": \"nudity|age|violence|privacy|safe\", \"detected_minors\": true/false}"""
+
+# Structured output
+# Constraining Gemini to JSON against a schema guarantees a parseable verdict;
+# temperature 0 keeps verdicts deterministic, which also suits the caches.
+TEXT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_safe": {"type": "boolean"},
+        "flag_reason": {"type": "string", "nullable": True},
+        "category": {"type": "string"}
+    },
+    "required": ["is_safe", "category"]
+}
+
+TEXT_BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            **TEXT_RESPONSE_SCHEMA["properties"]
+        },
+        "required": ["index", "is_safe", "category"]
+    }
+}
+
+IMAGE_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_safe": {"type": "boolean"},
+        "flag_reason": {"type": "string", "nullable": True},
+        "category": {"type": "string"},
+        "detected_minors": {"type": "boolean"}
+    },
+    "required": ["is_safe", "category"]
+}
+
+TEXT_GENERATION_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=TEXT_RESPONSE_SCHEMA,
+    temperature=0
+)
+
+TEXT_BATCH_GENERATION_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=TEXT_BATCH_RESPONSE_SCHEMA,
+    temperature=0
+)
+
+IMAGE_GENERATION_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=IMAGE_RESPONSE_SCHEMA,
+    temperature=0
+)
+
+# Moderation status values
+_APPROVED = "approved"
+_FLAGGED = "flagged"
+_PENDING = "pending"  # Not moderated yet (rate limited) - caller should retry
+
+# CORS Headers
+CORS_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Max-Age": "3600"
+}
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+
+# Pre-filter for trivial text that needs no LLM reasoning
+# Severe terms are always flagged; extra terms can be supplied as a
+# comma-separated MODERATION_BLOCKLIST env var without a code change.
+BLOCKLIST = (
+    "fuck", "fucking", "fucker", "motherfucker",
+    "cunt", "cunts",
+    "porn", "porno",
+    "kys", "kill yourself",
+)
+_extra_blocklist = tuple(
+    term.strip() for term in os.environ.get("MODERATION_BLOCKLIST", "").split(",") if term.strip()
+)
+_BLOCKLIST_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, BLOCKLIST + _extra_blocklist)) + r")\b",
+    re.IGNORECASE
+)
+# Single emoji approved without Gemini. Explicit allowlist - other symbols
+# (offensive gestures, hate symbols) still go to the model.
+SAFE_EMOJI = frozenset(
+    "😀😃😄😁😅😂🙂😊😍🥰😎🤩🤗😇"
+    "👍👏🙌🙏👋💪✌"
+    "❤💙💚💛🧡💜💯✨⭐🌟🎉🔥"
+    "☀🌞🌈🌲🌳🌸🌻🌄🌅⛰🏔🏞🗺📍🚶🥾📸"
+)
+# Joiners, variation selectors and skin-tone modifiers that decorate a single emoji
+_EMOJI_MODIFIERS = {"\u200d", "\ufe0e", "\ufe0f"} | {chr(c) for c in range(0x1F3FB, 0x1F400)}
+
+# Images are downscaled so their longest edge is at most this many pixels
+# before upload; Gemini downsamples internally anyway
+MAX_IMAGE_EDGE = 1024
+DOWNSCALE_JPEG_QUALITY = 85
+
+# Pillow formats sent to Gemini as-is; anything else is re-encoded as JPEG.
+# MPO is how Pillow reports camera JPEGs carrying an MPF marker.
+PASSTHROUGH_IMAGE_FORMATS = {
+    "JPEG": "image/jpeg",
+    "MPO": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif"
+}
+
+# Upper bound on items accepted in a single multi-item request
+MAX_ITEMS_PER_REQUEST = 32
+
+# Per-instance rate limit on Gemini generate calls
+# Bursts queue briefly instead of tripping the API quota (429s)
+GEMINI_REQUESTS_PER_MINUTE = 200
+GEMINI_BURST = 200
+RATE_LIMIT_MAX_WAIT_SECONDS = 2.0
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the Gemini rate limiter cannot admit a call in time."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gemini rate limit: retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks briefly while the bucket refills."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1, max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS):
+        """Take tokens, sleeping up to max_wait seconds for a refill."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+
+            if now + wait > deadline:
+                raise RateLimitExceeded(retry_after=wait)
+            time.sleep(wait)
+
+
+_bucket = TokenBucket(rate=GEMINI_REQUESTS_PER_MINUTE / 60, capacity=GEMINI_BURST)
+
+# Exact-match cache for text verdicts
+# Keyed by SHA256 of the input text; lives for the lifetime of the instance
+TEXT_CACHE_MAX_ENTRIES = 4096
+TEXT_CACHE_TTL_SECONDS = 6 * 60 * 60
+
+_text_cache = OrderedDict()  # sha256 hex -> (stored_at, result dict)
+_cache_stats = {"hits": 0, "misses": 0, "semantic_hits": 0, "image_hits": 0, "image_misses": 0,
+                "image_content_hits": 0}
+
+# Multi-item requests scan on worker threads, so cache access is serialised
+_cache_lock = threading.Lock()
+
+# Semantic near-duplicate cache for text verdicts
+# Paraphrases of previously approved text reuse the stored verdict.
+# Rows are L2-normalised so a dot product is the cosine similarity.
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIM = 768
+SEMANTIC_CACHE_MAX_ENTRIES = 2048
+SEMANTIC_SIMILARITY_THRESHOLD = 0.95
+# The cache is only an optimisation - a slow embedding falls through to Gemini
+EMBEDDING_TIMEOUT_SECONDS = 2
+
+_semantic_matrix = np.zeros((SEMANTIC_CACHE_MAX_ENTRIES, EMBEDDING_DIM), dtype=np.float32)
+_semantic_results = [None] * SEMANTIC_CACHE_MAX_ENTRIES
+_semantic_count = 0  # Number of populated rows
+_semantic_next = 0   # Next row to overwrite (FIFO eviction)
+
+# Image verdict cache
+# Keyed by SHA256 of the base64 payload or of the URL. Content behind a URL
+# can change, so URL-keyed entries expire much sooner.
+IMAGE_CACHE_MAX_ENTRIES = 512
+IMAGE_CACHE_TTL_SECONDS = 6 * 60 * 60
+IMAGE_URL_CACHE_TTL_SECONDS = 60 * 60
+
+_image_cache = OrderedDict()  # sha256 hex -> (expires_at, result dict)
+
+# Downloaded images are also cached by a hash of their bytes, so the same
+# picture behind a different URL is recognised
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def get_stats() -> dict:
+    """Return hit/miss counters for the in-process moderation caches."""
+    total = _cache_stats["hits"] + _cache_stats["misses"]
+    return {
+        "hits": _cache_stats["hits"],
+        "misses": _cache_stats["misses"],
+        "hit_rate": _cache_stats["hits"] / total if total else 0.0,
+        "semantic_hits": _cache_stats["semantic_hits"],
+        "text_cache_size": len(_text_cache),
+        "semantic_cache_size": _semantic_count,
+        "image_hits": _cache_stats["image_hits"],
+        "image_misses": _cache_stats["image_misses"],
+        "image_content_hits": _cache_stats["image_content_hits"],
+        "image_cache_size": len(_image_cache)
+    }
+
+
+def _text_cache_get(key: str):
+    """Return a cached verdict for key, or None on miss/expiry."""
+    with _cache_lock:
+        entry = _text_cache.get(key)
+        if entry is None:
+            _cache_stats["misses"] += 1
+            return None
+
+        stored_at, result = entry
+        if time.monotonic() - stored_at > TEXT_CACHE_TTL_SECONDS:
+            del _text_cache[key]
+            _cache_stats["misses"] += 1
+            return None
+
+        _text_cache.move_to_end(key)
+        _cache_stats["hits"] += 1
+        return dict(result)
+
+
+def _text_cache_put(key: str, result: dict):
+    """Store a verdict, evicting the least recently used entry when full."""
+    with _cache_lock:
+        _text_cache[key] = (time.monotonic(), dict(result))
+        _text_cache.move_to_end(key)
+        while len(_text_cache) > TEXT_CACHE_MAX_ENTRIES:
+            _text_cache.popitem(last=False)
+
+
+def _image_cache_get(key: str, hit_stat: str = "image_hits", miss_stat: str = "image_misses"):
+    """
+    Return a cached image verdict for key, or None on miss/expiry.
+    hit_stat/miss_stat name the counters to bump; None leaves them untouched.
+    """
+    with _cache_lock:
+        entry = _image_cache.get(key)
+        if entry is not None and time.monotonic() > entry[0]:
+            del _image_cache[key]
+            entry = None
+
+        if entry is None:
+            if miss_stat:
+                _cache_stats[miss_stat] += 1
+            return None
+
+        _image_cache.move_to_end(key)
+        if hit_stat:
+            _cache_stats[hit_stat] += 1
+        return dict(entry[1])
+
+
+def _image_cache_put(key: str, result: dict, ttl: float):
+    """Store an image verdict, evicting the least recently used entry when full."""
+    with _cache_lock:
+        _image_cache[key] = (time.monotonic() + ttl, dict(result))
+        _image_cache.move_to_end(key)
+        while len(_image_cache) > IMAGE_CACHE_MAX_ENTRIES:
+            _image_cache.popitem(last=False)
+
+
+def _embed_text(text: str):
+    """Return a normalised float32 embedding for text, or None if unavailable."""
+    return _embed_texts([text])[0]
+
+
+def _embed_texts(texts: list) -> list:
+    """Embed several texts in one call; entries are None where unavailable."""
+    embeddings = [None] * len(texts)
+    indices = [i for i, text in enumerate(texts) if text.strip()]
+    if not indices:
+        return embeddings
+    try:
+        result = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=[texts[i] for i in indices],
+            task_type="CLASSIFICATION",
+            request_options={"timeout": EMBEDDING_TIMEOUT_SECONDS}
+        )
+        matrix = np.asarray(result["embedding"], dtype=np.float32)
+        if matrix.shape != (len(indices), EMBEDDING_DIM):
+            return embeddings
+
+        norms = np.linalg.norm(matrix, axis=1)
+        for row, i in enumerate(indices):
+            if norms[row] > 0:
+                embeddings[i] = matrix[row] / norms[row]
+        return embeddings
+    except Exception as e:
+        logger.warning(f"Embedding failed, skipping semantic cache: {e}")
+        return embeddings
+
+
+def _semantic_cache_get(embedding):
+    """Return the verdict of the most similar cached text above threshold, or None."""
+    if embedding is None:
+        return None
+
+    with _cache_lock:
+        if _semantic_count == 0:
+            return None
+
+        similarities = _semantic_matrix[:_semantic_count] @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < SEMANTIC_SIMILARITY_THRESHOLD:
+            return None
+
+        _cache_stats["semantic_hits"] += 1
+        return dict(_semantic_results[best])
+
+
+def _semantic_cache_put(embedding, result: dict):
+    """Store an approved verdict against its embedding."""
+    global _semantic_count, _semantic_next
+
+    # Only approved verdicts are stored - flagged content is borderline by
+    # nature and a paraphrase of it must always get a fresh review
+    if embedding is None or not result.get("is_safe"):
+        return
+
+    with _cache_lock:
+        _semantic_matrix[_semantic_next] = embedding
+        _semantic_results[_semantic_next] = dict(result)
+        _semantic_next = (_semantic_next + 1) % SEMANTIC_CACHE_MAX_ENTRIES
+        _semantic_count = min(_semantic_count + 1, SEMANTIC_CACHE_MAX_ENTRIES)
+
 
 @functions_framework.http
 def moderate_content(request: Request):
@@ -52,22 +499,36 @@ def moderate_content(request: Request):
     Returns JSON:
     {
         "is_safe": bool,
-        "moderation_status": "approved" | "flagged",
+        "moderation_status": "approved" | "flagged" | "pending",
         "flag_reason": "reason if flagged",
         "model_used": "model name"
     }
+    When Gemini is rate limited the content is never approved: a single item
+    gets a 503 with Retry-After, multi-item results carry a "pending" entry.
+
+    Several texts can be moderated in one batched prompt (text only):
+    {
+        "content": ["text one...", "text two...", ...]
+    }
+    Returns JSON:
+    {
+        "results": [{"is_safe": ..., ...}, ...]  # Same order as content
+    }
+
+    Several items can be moderated concurrently in one call:
+    {
+        "items": [{"content": ..., "content_type": ...}, ...]
+    }
+    Returns JSON:
+    {
+        "results": [{"is_safe": ..., ...}, ...]  # Same order as items
+    }
     """
     # CORS Headers
     if request.method == "OPTIONS":
-        headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST",
-            "Access-Control-Allow-Headers": "Content-Type",
-            "Access-Control-Max-Age": "3600"
-        }
-        return ("", 204, headers)
+        return ("", 204, CORS_PREFLIGHT_HEADERS)
 
-    headers = {"Access-Control-Allow-Origin": "*"}
+    headers = CORS_HEADERS
 
     # Check models
     if not text_model:
@@ -79,173 +540,478 @@ def moderate_content(request: Request):
         if not request_json:
             return (jsonify({"error": "Invalid JSON"}), 400, headers)
         
-        content_text = request_json.get("content", "")
-        media_url = request_json.get("media_url")
-        media_b64 = request_json.get("media_b64")
-        content_type = request_json.get("content_type", "text")
+        items = request_json.get("items")
+        if items is not None:
+            if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+                return (jsonify({"error": "items must be a list of objects"}), 400, headers)
+            if len(items) > MAX_ITEMS_PER_REQUEST:
+                return (jsonify({"error": f"Too many items (max {MAX_ITEMS_PER_REQUEST})"}), 400, headers)
+            for item in items:
+                error = _validate_item(item)
+                if error:
+                    return (jsonify({"error": f"items[].{error}"}), 400, headers)
+        else:
+            error = _validate_item(request_json, allow_content_list=True)
+            if error:
+                return (jsonify({"error": error}), 400, headers)
+
+        texts = request_json.get("content")
 
     except Exception as e:
         logger.error(f"Error parsing request: {e}")
         return (jsonify({"error": "Bad Request"}), 400, headers)
 
-    # Route to appropriate handler
+    # Multiple items - moderate concurrently
+    if items is not None:
+        results = asyncio.run(_moderate_items(items))
+        return (jsonify({"results": results}), 200, headers)
+
+    # Multiple texts - batch into as few prompts as possible
+    # Per-item failures are handled inside the batch; this only catches
+    # errors raised before any verdicts exist
+    if isinstance(texts, list):
+        try:
+            results = _scan_text_batch(texts)
+        except RateLimitExceeded as e:
+            results = [_rate_limited_result(e) for _ in texts]
+        except Exception as e:
+            logger.error(f"Moderation Agent failed: {e}")
+            # Fail open to not block users on error
+            results = [_error_result(e) for _ in texts]
+        return (jsonify({"results": results}), 200, headers)
+
+    # Single item
     try:
-        if content_type == "text":
-            result = _scan_text(content_text)
-        elif content_type == "image":
-            result = _scan_image(media_url, media_b64)
-        elif content_type == "video":
-            # For video, we extract first frame and analyze
-            result = _scan_video_frame(media_url, media_b64)
-        elif content_type == "audio":
-            # For audio, approve with note (transcription can be added later)
-            result = {
-                "is_safe": True,
-                "moderation_status": "approved",
-                "flag_reason": None,
-                "model_used": "none (audio - manual review suggested)"
-            }
-        else:
-            result = _scan_text(content_text)
-        
+        result = _moderate_item(request_json)
         return (jsonify(result), 200, headers)
 
+    except RateLimitExceeded as e:
+        # Never fail open on throttling - ask the caller to retry
+        result = _rate_limited_result(e)
+        retry_headers = {**headers, "Retry-After": str(result["retry_after"])}
+        return (jsonify(result), 503, retry_headers)
+
     except Exception as e:
         logger.error(f"Moderation Agent failed: {e}")
         # Fail open to not block users on error
-        return (jsonify({
+        return (jsonify(_error_result(e)), 200, headers)
+
+
+def _validate_item(item: dict, allow_content_list: bool = False):
+    """
+    Check the field types of a moderation item.
+    Returns an error message, or None if the item is well-formed.
+    """
+    for field in ("media_url", "media_b64", "content_type"):
+        if item.get(field) is not None and not isinstance(item[field], str):
+            return f"{field} must be a string"
+
+    content = item.get("content")
+    if content is None or isinstance(content, str):
+        return None
+    if not allow_content_list:
+        return "content must be a string"
+
+    # Top-level text batch
+    if not isinstance(content, list):
+        return "content must be a string or a list of strings"
+    if item.get("content_type", "text") != "text":
+        return "content lists are only supported for text"
+    if not all(isinstance(t, str) for t in content):
+        return "content list must contain only strings"
+    if len(content) > MAX_ITEMS_PER_REQUEST:
+        return f"Too many items (max {MAX_ITEMS_PER_REQUEST})"
+    return None
+
+
+def _moderate_item(item: dict) -> dict:
+    """Route a single moderation item to the appropriate handler."""
+    content_text = item.get("content") or ""  # null is treated as no text
+    media_url = item.get("media_url")
+    media_b64 = item.get("media_b64")
+    content_type = item.get("content_type", "text")
+
+    if content_type == "text":
+        return _scan_text(content_text)
+    elif content_type == "image":
+        return _scan_image(media_url, media_b64)
+    elif content_type == "video":
+        # For video, we extract first frame and analyze
+        return _scan_video_frame(media_url, media_b64)
+    elif content_type == "audio":
+        # For audio, approve with note (transcription can be added later)
+        return {
             "is_safe": True,
-            "moderation_status": "approved",
-            "flag_reason": f"Agent Error: {str(e)}",
-            "model_used": "error"
-        }), 200, headers)
+            "moderation_status": _APPROVED,
+            "flag_reason": None,
+            "model_used": "none (audio - manual review suggested)"
+        }
+    else:
+        return _scan_text(content_text)
 
 
-def _scan_text(text: str) -> dict:
-    """Moderate text content using fast text model."""
-    prompt = f"""Role: Strict Content Safety Agent for Wandern - a family-friendly walking/exploration app.
-Task: Analyze the following text for App Store compliance.
+async def _moderate_items(items: list) -> list:
+    """
+    Moderate several items concurrently.
+    Gemini calls are IO-bound, so each item runs on a worker thread and the
+    wall time is that of the slowest item rather than the sum.
+    """
+    outcomes = await asyncio.gather(
+        *[asyncio.to_thread(_moderate_item, item) for item in items],
+        return_exceptions=True
+    )
 
-STRICT CONTENT POLICY - FLAG ANY OF THESE:
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, RateLimitExceeded):
+            results.append(_rate_limited_result(outcome))
+        elif isinstance(outcome, Exception):
+            logger.error(f"Moderation Agent failed: {outcome}")
+            # Fail open to not block users on error
+            results.append(_error_result(outcome))
+        else:
+            results.append(outcome)
+    return results
 
-1. NUDITY/SEXUAL CONTENT:
-   - Any references to nudity, pornography, or explicit sexual content
-   - Shirtless photos of men are NOT allowed (except in clear beach/pool context)
-   - Bikini tops and swimwear are OK in beach contexts
-   - Any sexualized content involving minors (ZERO TOLERANCE)
 
-2. AGE RESTRICTIONS:
-   - Content referencing children under 13 participating in app activities
-   - Content that could endanger minors
-   - Predatory behavior of any kind
+def _error_result(e: Exception) -> dict:
+    """Fail-open result returned when moderation errors out."""
+    return {
+        "is_safe": True,
+        "moderation_status": _APPROVED,
+        "flag_reason": f"Agent Error: {str(e)}",
+        "model_used": "error"
+    }
 
-3. VIOLENCE/SAFETY:
-   - Hate Speech / Harassment / Bullying
-   - Violence, gore, or disturbing content
-   - Dangerous / Illegal Acts / Self-harm
-   - Threats or intimidation
 
-4. OTHER:
-   - Severe Profanity (mild PG-13 is okay)
-   - Personal info sharing (phone numbers, addresses)
-   - Spam / Advertising
-   - Illegal drug use or sales
+def _rate_limited_result(e: RateLimitExceeded) -> dict:
+    """Non-approving result returned when the Gemini rate limiter rejects a call."""
+    return {
+        "is_safe": False,
+        "moderation_status": _PENDING,
+        "flag_reason": "Rate limited - retry later",
+        "model_used": "none (rate limited)",
+        "retry_after": max(1, math.ceil(e.retry_after))
+    }
 
-Input Text: \"{text}\"
 
-Output ONLY valid JSON:
-{{\"is_safe\": true/false, \"flag_reason\": \"short explanation if flagged, else null\", \"category\": \"nudity|age|violence|spam|safe\"}}"""
+def _prefilter(text: str):
+    """
+    Decide trivially safe/unsafe text without calling Gemini.
+    Returns (is_safe, flag_reason) when confident, else None.
+    """
+    stripped = text.strip()
+
+    # Empty, whitespace or punctuation only
+    if all(unicodedata.category(ch).startswith(("Z", "P")) for ch in stripped):
+        return (True, None)
+
+    # A single allowlisted emoji (with any modifiers)
+    base = [ch for ch in stripped if ch not in _EMOJI_MODIFIERS]
+    if len(base) == 1 and base[0] in SAFE_EMOJI:
+        return (True, None)
+
+    if _BLOCKLIST_RE.search(text):
+        return (False, "profanity")
+
+    return None
+
+
+def _scan_text(text: str) -> dict:
+    """Moderate text content using fast text model."""
+    # Trivial input - no LLM reasoning needed
+    decision = _prefilter(text)
+    if decision is not None:
+        return _prefilter_result(decision)
+
+    # Identical text moderated recently - skip the Gemini round-trip
+    cache_key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    cached = _text_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Near-duplicate of previously approved text
+    embedding = _embed_text(text)
+    cached = _semantic_cache_get(embedding)
+    if cached is not None:
+        _text_cache_put(cache_key, cached)
+        return cached
+
+    return _generate_text_verdict(text, cache_key, embedding)
+
+
+def _generate_text_verdict(text: str, cache_key: str, embedding) -> dict:
+    """Moderate a single text with Gemini, bypassing the cache lookups."""
+    prompt = TEXT_PROMPT_TEMPLATE.format(text=text)
     
     try:
-        response = text_model.generate_content(prompt)
-        cleaned = response.text.replace('```json', '').replace('```', '').strip()
-        data = json.loads(cleaned)
-        
-        is_safe = data.get("is_safe", False)
-        reason = data.get("flag_reason")
-        
-        return {
-            "is_safe": is_safe,
-            "moderation_status": "approved" if is_safe else "flagged",
-            "flag_reason": reason,
-            "model_used": TEXT_MODEL
-        }
+        _bucket.acquire()
+        response = text_model.generate_content(prompt, generation_config=TEXT_GENERATION_CONFIG)
+        data = json.loads(response.text)
+        return _text_result(data, cache_key, embedding)
     except Exception as e:
         logger.error(f"Text scan failed: {e}")
         raise e
 
 
+def _scan_text_batch(texts: list) -> list:
+    """
+    Moderate several texts, packing cache misses into batched prompts.
+    One call per TEXT_BATCH_MAX_ITEMS texts amortizes the policy header and
+    round-trip; results are returned in input order.
+    """
+    if len(texts) == 1:
+        return [_scan_text(texts[0])]
+
+    results = [None] * len(texts)
+
+    # Pre-filter and exact cache first
+    pending = []  # (index, text, cache_key)
+    for i, text in enumerate(texts):
+        decision = _prefilter(text)
+        if decision is not None:
+            results[i] = _prefilter_result(decision)
+            continue
+
+        cache_key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        cached = _text_cache_get(cache_key)
+        if cached is not None:
+            results[i] = cached
+            continue
+        pending.append((i, text, cache_key))
+
+    # Then near-duplicates, embedding all misses in one call
+    to_scan = []  # (index, text, cache_key, embedding)
+    embeddings = _embed_texts([text for _, text, _ in pending])
+    for (i, text, cache_key), embedding in zip(pending, embeddings):
+        cached = _semantic_cache_get(embedding)
+        if cached is not None:
+            _text_cache_put(cache_key, cached)
+            results[i] = cached
+            continue
+        to_scan.append((i, text, cache_key, embedding))
+
+    for start in range(0, len(to_scan), TEXT_BATCH_MAX_ITEMS):
+        chunk = to_scan[start:start + TEXT_BATCH_MAX_ITEMS]
+        if len(chunk) == 1:
+            i, text, cache_key, embedding = chunk[0]
+            results[i] = _generate_text_verdict_or_error(text, cache_key, embedding)
+            continue
+
+        numbered = [f"[{n}] {json.dumps(text, ensure_ascii=False)}" for n, (_, text, _, _) in enumerate(chunk)]
+        prompt = TEXT_BATCH_PROMPT_TEMPLATE.format(items="\n".join(numbered))
+        # When throttled, per-item fallback would only queue again
+        try:
+            _bucket.acquire()
+        except RateLimitExceeded as e:
+            for i, _, _, _ in chunk:
+                results[i] = _rate_limited_result(e)
+            continue
+
+        try:
+            response = text_model.generate_content(prompt, generation_config=TEXT_BATCH_GENERATION_CONFIG)
+            verdicts = {v.get("index"): v for v in json.loads(response.text) if isinstance(v, dict)}
+        except Exception as e:
+            logger.error(f"Batch text scan failed, falling back to per-item: {e}")
+            verdicts = {}
+
+        for n, (i, text, cache_key, embedding) in enumerate(chunk):
+            data = verdicts.get(n)
+            if data is None:
+                # Missing from the batch response - scan on its own
+                results[i] = _generate_text_verdict_or_error(text, cache_key, embedding)
+            else:
+                results[i] = _text_result(data, cache_key, embedding, shared_prompt=True)
+
+    return results
+
+
+def _generate_text_verdict_or_error(text: str, cache_key: str, embedding) -> dict:
+    """Per-item batch fallback; a failure only affects its own slot."""
+    try:
+        return _generate_text_verdict(text, cache_key, embedding)
+    except RateLimitExceeded as e:
+        return _rate_limited_result(e)
+    except Exception as e:
+        # Fail open to not block users on error
+        return _error_result(e)
+
+
+def _prefilter_result(decision: tuple) -> dict:
+    """Build the response for a pre-filter decision."""
+    is_safe, reason = decision
+    return {
+        "is_safe": is_safe,
+        "moderation_status": _APPROVED if is_safe else _FLAGGED,
+        "flag_reason": reason,
+        "model_used": "prefilter"
+    }
+
+
+def _text_result(data: dict, cache_key: str, embedding, shared_prompt: bool = False) -> dict:
+    """
+    Build the response for a parsed text verdict and cache it.
+    shared_prompt marks verdicts from a multi-text prompt, where another text
+    could have injected instructions; their approvals are never cached.
+    """
+    raw_is_safe = data.get("is_safe")
+    is_safe = raw_is_safe is True
+    result = {
+        "is_safe": is_safe,
+        "moderation_status": _APPROVED if is_safe else _FLAGGED,
+        "flag_reason": data.get("flag_reason"),
+        "model_used": TEXT_MODEL
+    }
+
+    # Only cache well-formed verdicts
+    if isinstance(raw_is_safe, bool):
+        if not shared_prompt:
+            _text_cache_put(cache_key, result)
+            _semantic_cache_put(embedding, result)
+        elif not is_safe:
+            _text_cache_put(cache_key, result)
+
+    return result
+
+
 def _scan_image(media_url: str = None, media_b64: str = None) -> dict:
     """Moderate image content using vision model."""
+    if not media_b64 and not media_url:
+        return {
+            "is_safe": True,
+            "moderation_status": _APPROVED,
+            "flag_reason": "No image provided",
+            "model_used": VISION_MODEL
+        }
+
+    # Same image seen recently - skip decode, download and vision call
+    cache_key = hashlib.sha256(media_b64.encode() if media_b64 else media_url.encode()).hexdigest()
+    cache_ttl = IMAGE_CACHE_TTL_SECONDS if media_b64 else IMAGE_URL_CACHE_TTL_SECONDS
+    cached = _image_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         # Get image data
+        content_key = None
         if media_b64:
-            image_data = base64.b64decode(media_b64)
-        elif media_url:
-            # Download image from URL
-            with httpx.Client(timeout=30) as client:
-                response = client.get(media_url)
-                response.raise_for_status()
-                image_data = response.content
+            import pybase64  # Lazy - text-only cold starts skip it
+            image_data = pybase64.b64decode(media_b64)
         else:
-            return {
-                "is_safe": True,
-                "moderation_status": "approved",
-                "flag_reason": "No image provided",
-                "model_used": VISION_MODEL
-            }
+            # Download image from URL, hashing chunks as they arrive
+            image_data, content_key = _download_image(media_url)
+
+            # Same bytes already seen behind another URL
+            # The URL lookup already counted this request's miss
+            cached = _image_cache_get(content_key, hit_stat="image_content_hits", miss_stat=None)
+            if cached is not None:
+                _image_cache_put(cache_key, cached, cache_ttl)
+                return cached
         
         # Create image part for Gemini
+        image_data, mime_type = _downscale_image(image_data)
         image_part = {
-            "mime_type": "image/jpeg",  # Assume JPEG, works for most
+            "mime_type": mime_type,
             "data": image_data
         }
         
-        prompt = """Role: Strict Content Safety Agent for Wandern - a family-friendly walking app.
-Analyze this image for App Store compliance.
+        _bucket.acquire()
+        response = vision_model.generate_content(
+            [IMAGE_PROMPT, image_part],
+            generation_config=IMAGE_GENERATION_CONFIG
+        )
+        data = json.loads(response.text)
+        
+        raw_is_safe = data.get("is_safe")
+        is_safe = raw_is_safe is True
+        result = {
+            "is_safe": is_safe,
+            "moderation_status": _APPROVED if is_safe else _FLAGGED,
+            "flag_reason": data.get("flag_reason"),
+            "model_used": VISION_MODEL
+        }
 
-STRICT CONTENT POLICY - FLAG IF IMAGE CONTAINS:
+        # Only cache well-formed verdicts
+        if isinstance(raw_is_safe, bool):
+            _image_cache_put(cache_key, result, cache_ttl)
+            if content_key:
+                _image_cache_put(content_key, result, IMAGE_CACHE_TTL_SECONDS)
 
-1. NUDITY/SEXUAL:
-   - Any nudity (full or partial)
-   - Shirtless men (FLAG unless clearly beach/pool setting)
-   - Sexually suggestive poses or content
-   - Bikini tops and swimwear are OK in beach/pool contexts only
+        return result
+    except Exception as e:
+        logger.error(f"Image scan failed: {e}")
+        raise e
 
-2. AGE CONCERNS:
-   - Children who appear under 13 years old (FLAG - app is 13+)
-   - If a person looks under 18 but over 13, flag for review
-   - Any content sexualizing minors (ZERO TOLERANCE - immediate flag)
 
-3. VIOLENCE/SAFETY:
-   - Violence, gore, blood, or disturbing imagery
-   - Weapons being used threateningly
-   - Hate symbols, Nazi imagery, offensive gestures
-   - Dangerous activities that could cause harm
+def _get_http():
+    """Return the shared HTTP client, creating it on first use."""
+    global _HTTP
+    if _HTTP is None:
+        with _http_lock:
+            if _HTTP is None:
+                import httpx  # Lazy - text-only cold starts skip it
+                _HTTP = httpx.Client(
+                    http2=True,
+                    timeout=30,
+                    limits=httpx.Limits(max_keepalive_connections=32)
+                )
+    return _HTTP
 
-4. PRIVACY:
-   - Visible personal information (addresses, credit cards, IDs)
-   - License plates, house numbers in identifiable context
 
-Output ONLY valid JSON:
-{\"is_safe\": true/false, \"flag_reason\": \"specific explanation if flagged, else null\", \"category\": \"nudity|age|violence|privacy|safe\", \"detected_minors\": true/false}"""
+def _download_image(media_url: str) -> tuple:
+    """
+    Stream an image from media_url.
+    Returns (bytes, sha256 hex of the bytes); hashing overlaps the network wait.
+    """
+    digest = hashlib.sha256()
+    buf = bytearray()
+    with _get_http().stream("GET", media_url) as response:
+        response.raise_for_status()
+        for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buf.extend(chunk)
+    return bytes(buf), digest.hexdigest()
 
-        response = vision_model.generate_content([prompt, image_part])
-        cleaned = response.text.replace('```json', '').replace('```', '').strip()
-        data = json.loads(cleaned)
-        
-        is_safe = data.get("is_safe", False)
-        reason = data.get("flag_reason")
-        
-        return {
-            "is_safe": is_safe,
-            "moderation_status": "approved" if is_safe else "flagged",
-            "flag_reason": reason,
-            "model_used": VISION_MODEL
-        }
+
+def _downscale_image(image_data: bytes) -> tuple:
+    """
+    Shrink large images to MAX_IMAGE_EDGE before upload.
+    Returns (bytes, mime_type). Small images in a format Gemini accepts pass
+    through untouched; other decodable formats are re-encoded as JPEG, and
+    undecodable data passes through with a sniffed MIME type.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        passthrough_mime = PASSTHROUGH_IMAGE_FORMATS.get(img.format)
+        if passthrough_mime and max(img.size) <= MAX_IMAGE_EDGE:
+            return image_data, passthrough_mime
+
+        # Re-encoding drops EXIF, so bake the orientation into the pixels
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > MAX_IMAGE_EDGE:
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=DOWNSCALE_JPEG_QUALITY, optimize=True)
+        return buf.getvalue(), "image/jpeg"
     except Exception as e:
-        logger.error(f"Image scan failed: {e}")
-        raise e
+        logger.warning(f"Image downscale skipped: {e}")
+        return image_data, _sniff_mime(image_data)
+
+
+def _sniff_mime(data: bytes) -> str:
+    """Detect image MIME type from magic bytes, defaulting to JPEG."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"  # Unknown - JPEG works for most
 
 
 def _scan_video_frame(media_url: str = None, media_b64: str = None) -> dict:
@@ -266,15 +1032,17 @@ def _scan_video_frame(media_url: str = None, media_b64: str = None) -> dict:
             # For actual video files, we'd need ffmpeg - approve with note
             return {
                 "is_safe": True,
-                "moderation_status": "approved",
+                "moderation_status": _APPROVED,
                 "flag_reason": "Video moderation requires frame extraction - manual review suggested",
                 "model_used": "none (video - needs frame extraction)"
             }
+    except RateLimitExceeded:
+        raise
     except Exception as e:
         logger.error(f"Video scan failed: {e}")
         return {
             "is_safe": True,
-            "moderation_status": "approved",
+            "moderation_status": _APPROVED,
             "flag_reason": f"Video scan error: {str(e)}",
             "model_used": "error"
         }